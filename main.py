@@ -1,28 +1,37 @@
 
 from flask import Flask, request, jsonify, render_template
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+import orjson
 import os
-import time
-import werkzeug
 
 # Import the analysis engine we created earlier
 from vocalysis_analyzer import run_full_analysis
 
+
+# --- JSON Serialization ---
+class OrjsonProvider(JSONProvider):
+    """
+    Serializes responses with orjson, which is much faster than the stdlib json
+    module and handles NumPy scalars and arrays directly.
+    """
+    options = orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Initialize the Flask app
 app = Flask(__name__, template_folder='templates')
+app.json = OrjsonProvider(app)
 
 # Enable CORS (Cross-Origin Resource Sharing) to allow our frontend
 # to communicate with this server.
 CORS(app)
 
-# --- Configuration ---
-# Define a folder to temporarily store uploaded files for analysis
-UPLOAD_FOLDER = 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
 
 # --- API Endpoint for Analysis ---
 @app.route('/analyze', methods=['POST'])
@@ -41,32 +50,15 @@ def analyze_audio():
         return jsonify({"error": "No selected file"}), 400
 
     if file:
-        # Secure the filename to prevent directory traversal issues
-        filename = werkzeug.utils.secure_filename(file.filename)
-        
-        # Save the file to our temporary upload folder
-        temp_audio_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(temp_audio_path)
-
         # --- Run the Core Analysis ---
+        # The upload is decoded straight from the request stream, so nothing
+        # is written to (or has to be cleaned up from) disk.
         try:
-            analysis_results = run_full_analysis(temp_audio_path)
+            analysis_results = run_full_analysis(file.stream, file.filename)
         except Exception as e:
             # Handle potential errors during analysis
             # This is a fallback for unexpected errors in the analyzer.
             return jsonify({"error": f"Analysis failed unexpectedly: {str(e)}"}), 500
-        finally:
-            # --- Clean Up ---
-            # Robustly remove the temporary file after analysis.
-            # Add a small delay to ensure the file lock is released.
-            time.sleep(0.1) # Wait 100ms
-            if os.path.exists(temp_audio_path):
-                try:
-                    os.remove(temp_audio_path)
-                except OSError as e:
-                    # Log if the file couldn't be removed, but don't crash.
-                    print(f"Error removing file {temp_audio_path}: {e}")
-
 
         # Check if the analysis itself returned an error (like a loading issue)
         if "error" in analysis_results:
@@ -89,7 +81,13 @@ def home():
 
 
 # --- Main Execution ---
+# This block is for local development only. In production, serve the app with a
+# WSGI server so the Whisper model is loaded once and requests run concurrently:
+#   gunicorn -w 1 --threads 8 -b 0.0.0.0:5000 main:app
+#   waitress-serve --threads=8 --listen=0.0.0.0:5000 main:app   (Windows)
 if __name__ == '__main__':
-    # Run the Flask app. `debug=True` allows for auto-reloading when you save changes.
+    # Set VOCALYSIS_DEBUG=1 for auto-reloading when you save changes. It is off by
+    # default because every reload has to load the Whisper model again.
+    debug = os.environ.get('VOCALYSIS_DEBUG', '0') == '1'
     # The host '0.0.0.0' makes it accessible on your local network.
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=debug, threaded=True)
@@ -0,0 +1,178 @@
+# vocalysis_acoustics.py
+# The audio-only analyzers (pitch, RMS, clarity, engagement, volume stability).
+# This module has no side effects beyond compiling its numba kernel, so the
+# analysis worker processes import it instead of vocalysis_analyzer and never
+# load Whisper.
+
+import librosa
+import numpy as np
+import math
+from numba import njit
+from multiprocessing import shared_memory
+
+
+# --- HELPER FUNCTIONS ---
+
+def normalize_score(value, min_val, max_val, reverse=False):
+    """Normalizes a value to a 0-10 scale."""
+    value = max(min(value, max_val), min_val)
+    normalized = (value - min_val) / (max_val - min_val)
+    if reverse:
+        return (1 - normalized) * 10
+    return normalized * 10
+
+# Sample rate used for pitch tracking and onset detection
+PITCH_ONSET_SR = 8000
+
+# Frames quieter than this fraction of the clip's loudest frame (-20 dB) are
+# treated as unvoiced when tracking pitch
+VOICED_RMS_RATIO = 0.1
+
+def compute_rms(y, frame_length=2048, hop_length=512):
+    """Frame-wise RMS energy, matching librosa.feature.rms(y=y)[0]."""
+    # With a running sum of y^2, each frame's power is one subtraction, so only
+    # the frames librosa would return are computed, in a single O(N) pass.
+    padded = np.pad(y, frame_length // 2)
+    energy = np.concatenate(([0.0], np.cumsum(padded * padded, dtype=np.float64)))
+    starts = np.arange(1 + (len(padded) - frame_length) // hop_length) * hop_length
+    return np.sqrt((energy[starts + frame_length] - energy[starts]) / frame_length)
+
+def extract_pitch(y, sr, rms=None):
+    """
+    Returns the fundamental-frequency values (Hz) of the voiced frames. `rms` may
+    be passed in if it was computed on the same 128ms window / 32ms hop grid.
+    """
+    # YIN works on the time-domain signal directly, so there is no full STFT
+    # and magnitudes matrix to build just to pick one pitch per frame.
+    # Keep the analysis window at 128ms whatever the sample rate
+    frame_length = 2048 * sr // 16000
+    hop_length = frame_length // 4
+    f0 = librosa.yin(y, fmin=50, fmax=400, sr=sr, frame_length=frame_length, hop_length=hop_length)
+
+    # YIN makes no voiced/unvoiced decision: pauses and breaths still get an f0
+    # somewhere in [fmin, fmax]. Keep only frames with real energy in them.
+    if rms is None:
+        rms = compute_rms(y, frame_length, hop_length)
+    num_frames = min(len(f0), len(rms))
+    f0, rms = f0[:num_frames], rms[:num_frames]
+    voiced = np.isfinite(f0) & (rms > VOICED_RMS_RATIO * rms.max(initial=0))
+    return f0[voiced]
+
+@njit(cache=True, fastmath=True)
+def _reduce_stats(pitch_values, rms):
+    """One pass over each track: (jitter, shimmer, pitch range, RMS std)."""
+    jitter = 0.0
+    pitch_min = pitch_max = pitch_values[0] if pitch_values.size > 0 else 0.0
+    for i in range(1, pitch_values.size):
+        jitter += abs(pitch_values[i] - pitch_values[i - 1])
+        pitch_min = min(pitch_min, pitch_values[i])
+        pitch_max = max(pitch_max, pitch_values[i])
+    if pitch_values.size > 1:
+        jitter /= pitch_values.size - 1
+
+    shimmer = 0.0
+    rms_sum = rms_sq_sum = 0.0
+    for i in range(rms.size):
+        rms_sum += rms[i]
+        rms_sq_sum += rms[i] * rms[i]
+        if i > 0:
+            shimmer += abs(rms[i] - rms[i - 1])
+    if rms.size > 1:
+        shimmer /= rms.size - 1
+    rms_std = 0.0
+    if rms.size > 0:
+        rms_mean = rms_sum / rms.size
+        rms_std = math.sqrt(max(rms_sq_sum / rms.size - rms_mean * rms_mean, 0.0))
+
+    return jitter, shimmer, pitch_max - pitch_min, rms_std
+
+def reduce_stats(pitch_values, rms):
+    """Returns (jitter, shimmer, pitch_range, rms_std) for the pitch and RMS tracks."""
+    # The tracks are per-frame, so casting is cheap and keeps a single compiled signature
+    return _reduce_stats(np.asarray(pitch_values, dtype=np.float64), np.asarray(rms, dtype=np.float64))
+
+# Compile (or load from the on-disk cache) now rather than on the first request
+reduce_stats(np.zeros(2), np.zeros(2))
+
+# --- CORE ANALYSIS FUNCTIONS ---
+
+def analyze_clarity(y, sr, pitch_values=None, rms=None, stats=None):
+    """Analyzes the clarity of speech based on vocal stability (jitter and shimmer)."""
+    try:
+        if pitch_values is None:
+            pitch_values = extract_pitch(y, sr)
+        if len(pitch_values) < 2: return 0.0
+        if stats is None:
+            stats = reduce_stats(pitch_values, compute_rms(y) if rms is None else rms)
+        jitter, shimmer, _, _ = stats
+        clarity_score = (normalize_score(jitter, 0, 5, reverse=True) + normalize_score(shimmer, 0, 0.1, reverse=True)) / 2
+        return clarity_score
+    except Exception:
+        return 0.0
+
+def analyze_volume_stability(y, rms=None, stats=None):
+    """Scores how steady the speaker's volume is (the audio-only half of confidence)."""
+    try:
+        if stats is None:
+            stats = reduce_stats(np.empty(0), compute_rms(y) if rms is None else rms)
+        return normalize_score(stats[3], 0, 0.1, reverse=True)
+    except Exception:
+        return 0.0
+
+def analyze_energy_engagement(y, sr, pitch_values=None, duration=None, stats=None):
+    """Analyzes energy/engagement via pitch range and speech rate."""
+    try:
+        if stats is None:
+            stats = reduce_stats(extract_pitch(y, sr) if pitch_values is None else pitch_values, np.empty(0))
+        if duration is None:
+            duration = len(y) / sr
+        if duration == 0: return 0.0
+        pitch_range_score = normalize_score(stats[2], 50, 250)
+        # Keep the 16kHz defaults' 32ms hop / 128ms window at any sample rate, so
+        # peak picking (derived from sr // hop_length) and the 2-6 onsets/s scale hold
+        hop_length = 512 * sr // 16000
+        onset_envelope = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length, n_fft=2048 * sr // 16000)
+        onsets = librosa.onset.onset_detect(onset_envelope=onset_envelope, sr=sr, hop_length=hop_length)
+        speech_rate_score = normalize_score(len(onsets) / duration, 2, 6)
+        return (pitch_range_score + speech_rate_score) / 2
+    except Exception:
+        return 0.0
+
+# --- Worker Entry Points ---
+
+def run_acoustic_analysis(y, sr):
+    """Returns (clarity, engagement, volume stability) scores for `y`."""
+    # Pitch (<= 400 Hz) and onset rate don't need the top half of the
+    # spectrum, so run them on a downsampled copy to shrink their frames.
+    y_low = librosa.resample(y, orig_sr=sr, target_sr=PITCH_ONSET_SR)
+
+    # Compute the expensive shared features once instead of per analyzer
+    # Both tracks use a 32ms hop (512 samples at 16kHz, 256 at 8kHz), so the
+    # full-rate RMS frames line up with the pitch frames for voicing
+    rms = compute_rms(y)
+    pitch_values = extract_pitch(y_low, PITCH_ONSET_SR, rms)
+    duration = len(y) / sr
+    stats = reduce_stats(pitch_values, rms)
+
+    clarity_score = analyze_clarity(y, sr, pitch_values, rms, stats)
+    engagement_score = analyze_energy_engagement(y_low, PITCH_ONSET_SR, pitch_values, duration, stats)
+    volume_stability_score = analyze_volume_stability(y, rms, stats)
+    return clarity_score, engagement_score, volume_stability_score
+
+
+def analyze_shared_audio(shm_name, num_samples, sr):
+    """Process pool entry point: runs the acoustic analyzers on shared audio."""
+    # The parent created the block and owns its lifetime; we only attach to it
+    shm = shared_memory.SharedMemory(name=shm_name)
+    y = None
+    try:
+        y = np.ndarray((num_samples,), dtype=np.float32, buffer=shm.buf)
+        return run_acoustic_analysis(y, sr)
+    finally:
+        y = None # The view must be released before the block can be closed
+        shm.close()
+
+
+def warm_up_worker():
+    """No-op task used to start a worker; importing this module does the warm-up."""
+    return None
@@ -1,21 +1,40 @@
 # vocalysis_analyzer.py (Stable Version with pydub)
 # This file contains all the core analysis functions.
-# It uses the pydub library for robust loading of all audio formats.
+# Audio is decoded in memory with soundfile; pydub is kept as a fallback
+# for formats libsndfile can't read.
 #
 # -----------------
 # --- SETUP ---
 # -----------------
-# Ensure you have: pip install Flask flask_cors librosa numpy openai-whisper pydub
+# Ensure you have: pip install Flask flask_cors librosa soundfile numpy numba faster-whisper pydub
 # And that ffmpeg is installed on your system.
 # -----------------
 
 import librosa
+import soundfile as sf
 import numpy as np
-import math
-import whisper
+import ctranslate2
+from faster_whisper import WhisperModel, BatchedInferencePipeline
 import os
 import io
+import queue
+import re
+import threading
 import warnings
+import hashlib
+import atexit
+from collections import OrderedDict
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from vocalysis_acoustics import (
+    normalize_score,
+    analyze_volume_stability,
+    analyze_shared_audio,
+    warm_up_worker,
+)
 
 # --- Suppress the harmless "Couldn't find ffmpeg" warning from pydub ---
 with warnings.catch_warnings():
@@ -41,55 +60,57 @@ else:
 
 # --- HELPER FUNCTIONS ---
 
-def normalize_score(value, min_val, max_val, reverse=False):
-    """Normalizes a value to a 0-10 scale."""
-    value = max(min(value, max_val), min_val)
-    normalized = (value - min_val) / (max_val - min_val)
-    if reverse:
-        return (1 - normalized) * 10
-    return normalized * 10
+def load_audio(audio_bytes, buffer=None):
+    """
+    Decodes raw audio file bytes into a mono 16kHz float32 array. When `buffer`
+    is given and the file is already mono 16kHz, samples are decoded straight
+    into it and the returned array is a view of the buffer.
+    """
+    try:
+        with sf.SoundFile(io.BytesIO(audio_bytes)) as f:
+            if buffer is not None and f.channels == 1 and f.samplerate == 16000 and f.frames <= len(buffer):
+                return f.read(out=buffer[:f.frames]), f.samplerate
+            y = f.read(dtype="float32", always_2d=True)
+            sr = f.samplerate
+    except Exception:
+        return load_with_pydub(io.BytesIO(audio_bytes))
+    y = y.mean(axis=1)
+    if sr != 16000:
+        y = librosa.resample(y, orig_sr=sr, target_sr=16000)
+        sr = 16000
+    return y, sr
+
+def load_with_pydub(audio_file):
+    """Fallback loader via pydub/ffmpeg for formats libsndfile can't read."""
+    audio_segment = AudioSegment.from_file(audio_file)
+    # Convert to a standard format (mono, 16kHz) for consistent analysis
+    audio_segment = audio_segment.set_channels(1).set_frame_rate(16000)
+    # Scale the raw integer samples to floats in [-1, 1]
+    samples = np.array(audio_segment.get_array_of_samples(), dtype=np.float32)
+    samples /= float(1 << (8 * audio_segment.sample_width - 1))
+    return samples, audio_segment.frame_rate
 
 # --- CORE ANALYSIS FUNCTIONS ---
+# The audio-only analyzers live in vocalysis_acoustics; only the transcript-
+# dependent half of confidence is scored here.
 
-def analyze_clarity(y, sr):
-    """Analyzes the clarity of speech based on vocal stability (jitter and shimmer)."""
-    try:
-        pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
-        pitch_values = [pitches[magnitudes[:, t].argmax(), t] for t in range(pitches.shape[1]) if pitches[magnitudes[:, t].argmax(), t] > 0]
-        if len(pitch_values) < 2: return 0.0
-        jitter = np.mean(np.abs(np.diff(pitch_values)))
-        shimmer = np.mean(np.abs(np.diff(librosa.feature.rms(y=y)[0])))
-        clarity_score = (normalize_score(jitter, 0, 5, reverse=True) + normalize_score(shimmer, 0, 0.1, reverse=True)) / 2
-        return clarity_score
-    except Exception:
-        return 0.0
+# Matched as whole words/phrases so multi-word fillers like "you know" count too
+FILLER_WORDS_RE = re.compile(r"\b(?:um|uh|like|you know|so|actually|basically)\b", re.IGNORECASE)
 
-def analyze_confidence(y, sr, transcribed_text):
+def analyze_confidence(y, sr, transcribed_text, volume_stability_score=None):
     """Analyzes confidence from volume stability and lack of filler words."""
     try:
-        volume_stability_score = normalize_score(np.std(librosa.feature.rms(y=y)[0]), 0, 0.1, reverse=True)
-        words = transcribed_text.lower().split()
-        if not words: return volume_stability_score
-        filler_count = sum(1 for word in words if word in ["um", "uh", "like", "you know", "so", "actually", "basically"])
-        filler_ratio = filler_count / (len(words) / 100.0) if words else 0
+        if volume_stability_score is None:
+            volume_stability_score = analyze_volume_stability(y)
+        word_count = len(transcribed_text.split())
+        if not word_count: return volume_stability_score
+        filler_count = len(FILLER_WORDS_RE.findall(transcribed_text))
+        filler_ratio = filler_count / (word_count / 100.0)
         filler_word_score = normalize_score(filler_ratio, 0, 10, reverse=True)
         return (volume_stability_score + filler_word_score) / 2
     except Exception:
         return 0.0
 
-def analyze_energy_engagement(y, sr):
-    """Analyzes energy/engagement via pitch range and speech rate."""
-    try:
-        pitches, _ = librosa.piptrack(y=y, sr=sr)
-        pitch_values = pitches[pitches > 0]
-        duration = librosa.get_duration(y=y, sr=sr)
-        if duration == 0: return 0.0
-        pitch_range_score = normalize_score(np.ptp(pitch_values) if len(pitch_values) > 1 else 0, 50, 250)
-        speech_rate_score = normalize_score(len(librosa.onset.onset_detect(y=y, sr=sr)) / duration, 2, 6)
-        return (pitch_range_score + speech_rate_score) / 2
-    except Exception:
-        return 0.0
-
 def placeholder_mood_analysis():
     """Placeholder for a real Speech Emotion Recognition (SER) model."""
     return {"Status": "Not Implemented"}
@@ -100,37 +121,293 @@ def placeholder_professionalism_score(clarity, confidence):
         return "Not Calculated"
     return (clarity + confidence) / 2
 
+# --- Acoustic Analysis Pool ---
+# The librosa analyzers still do a fair amount of Python-level work, so under
+# concurrent uploads they run in worker processes instead of fighting over the
+# GIL. Workers are spawned (not forked) so they don't inherit the Whisper model
+# or its threads; their tasks live in vocalysis_acoustics, so that is all they
+# import. The audio is handed over through shared memory rather than pickled.
+
+# Windows caps ProcessPoolExecutor at 61 workers
+ANALYSIS_WORKERS = min(os.cpu_count() or 1, 61)
+
+# Spawned workers re-run the parent's entry script, which may import this
+# module; they only need vocalysis_acoustics, so skip the model, pool and
+# buffer setup there.
+IS_CHILD_PROCESS = multiprocessing.parent_process() is not None
+
+# Created on the first submit, never at import: starting processes while a
+# spawned child is still importing its parent's script would fail.
+_analysis_pool = None
+_analysis_pool_lock = threading.Lock()
+
+
+def _start_analysis_pool():
+    """
+    Creates the process pool used for the acoustic analyzers and starts all of
+    its workers at once, rather than one per request as load grows.
+    """
+    pool = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    # The executor spawns a new worker for each submit while none are idle
+    for _ in range(ANALYSIS_WORKERS):
+        pool.submit(warm_up_worker)
+    return pool
+
+
+def _get_analysis_pool():
+    """Returns the analysis pool, creating it on first use."""
+    global _analysis_pool
+    if _analysis_pool is None:
+        with _analysis_pool_lock:
+            if _analysis_pool is None:
+                _analysis_pool = _start_analysis_pool()
+    return _analysis_pool
+
+
+def _submit_to_analysis_pool(fn, *args):
+    """Submits to the analysis pool, replacing it first if a worker has died."""
+    global _analysis_pool
+    pool = _get_analysis_pool()
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        # A worker was killed (e.g. by the OOM killer); the executor never
+        # recovers on its own, so swap in a fresh one and retry once.
+        with _analysis_pool_lock:
+            if _analysis_pool is pool:
+                print("Analysis pool is broken; restarting it.")
+                _analysis_pool = _start_analysis_pool()
+        return _analysis_pool.submit(fn, *args)
+
+
+def free_shared_block(shm):
+    """Closes and unlinks a shared memory block this process created."""
+    try:
+        shm.close()
+    except BufferError:
+        pass # A stray view is still alive; the mapping goes when it does
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def submit_acoustic_analysis(y, sr, block=None):
+    """
+    Starts the acoustic analysis of `y` in the process pool. The samples reach the
+    worker through `block`, a borrowed audio buffer: in place when `y` was decoded
+    into it, otherwise copied to its start. Without a block big enough, a temporary
+    one is created. Returns (future, temp_block); the caller must pass `temp_block`
+    to free_shared_block() (when it isn't None) once the future has finished.
+    """
+    temp_block = None
+    if block is None or y.nbytes > block.size:
+        block = temp_block = shared_memory.SharedMemory(create=True, size=max(y.nbytes, 1))
+    shared = None
+    try:
+        shared = np.ndarray(y.shape, dtype=np.float32, buffer=block.buf)
+        if shared.ctypes.data != y.ctypes.data:
+            shared[:] = y
+        shared = None
+        return _submit_to_analysis_pool(analyze_shared_audio, block.name, len(y), sr), temp_block
+    except BaseException:
+        # Nothing will ever read a temporary block, so free it now rather than leak it
+        shared = None
+        if temp_block is not None:
+            free_shared_block(temp_block)
+        raise
+
+
 # --- Main Analysis Runner ---
-print("Loading Whisper STT model...")
-whisper_model = whisper.load_model("base")
-print("Whisper model loaded.")
+# Load the model once, on the GPU when there is one. faster-whisper runs on
+# CTranslate2 with INT8 weights (FP16 activations on CUDA). CTranslate2 keeps
+# the encoder output and decoder KV cache on the device for the whole decode,
+# so only the features go in and the token ids come out.
+WHISPER_DEVICE = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+WHISPER_COMPUTE_TYPE = "int8_float16" if WHISPER_DEVICE == "cuda" else "int8"
 
+# The batched pipeline decodes up to WHISPER_BATCH_SIZE 30s windows per
+# forward pass instead of one at a time.
+WHISPER_BATCH_SIZE = 8
 
-def run_full_analysis(audio_path):
+def load_whisper_models():
+    """Loads and warms up the Whisper model and its batched pipeline."""
+    print(f"Loading Whisper STT model on {WHISPER_DEVICE} ({WHISPER_COMPUTE_TYPE})...")
+    model = WhisperModel("base", device=WHISPER_DEVICE, compute_type=WHISPER_COMPUTE_TYPE)
+    batched_model = BatchedInferencePipeline(model=model)
+
+    # Warm the model up with one second of silence so the first real request
+    # doesn't pay the CUDA/cuDNN initialisation cost. Whisper pads every input to
+    # a fixed 30s window, so this exercises the same encoder shape as real audio.
+    warmup_audio = np.zeros(16000, dtype=np.float32)
+    warmup_segments, _ = model.transcribe(warmup_audio, language="en", beam_size=1)
+    list(warmup_segments)
+    # Requests go through the batched pipeline, whose VAD model is otherwise
+    # loaded lazily on the first real transcription.
+    warmup_segments, _ = batched_model.transcribe(warmup_audio, language="en", beam_size=1, batch_size=WHISPER_BATCH_SIZE)
+    list(warmup_segments)
+    print("Whisper model loaded.")
+    return model, batched_model
+
+
+whisper_model = batched_whisper_model = None
+_whisper_lock = threading.Lock()
+
+
+def get_batched_whisper_model():
+    """Returns the batched pipeline, loading the model first if needed."""
+    global whisper_model, batched_whisper_model
+    if batched_whisper_model is None:
+        with _whisper_lock:
+            if batched_whisper_model is None:
+                whisper_model, batched_whisper_model = load_whisper_models()
+    return batched_whisper_model
+
+
+# Load eagerly in the serving process so the first request is warm; a child
+# process only loads the model if it actually transcribes something.
+if not IS_CHILD_PROCESS:
+    get_batched_whisper_model()
+
+
+# --- Transcription ---
+# Each request transcribes its own clip. BatchedInferencePipeline batches the
+# 30s windows of that one clip (see WHISPER_BATCH_SIZE); windows from separate
+# uploads are not batched together. CTranslate2 is thread-safe, so concurrent
+# request threads can call the shared model directly.
+def transcribe_audio(y):
+    """Transcribes a mono 16kHz float32 array and returns the full text."""
+    segments, _ = get_batched_whisper_model().transcribe(y, language="en", beam_size=1, batch_size=WHISPER_BATCH_SIZE)
+    # `segments` is a lazy generator; decoding happens while we join it
+    return "".join(segment.text for segment in segments)
+
+
+# --- Result Cache ---
+# A small LRU of finished analyses keyed by a hash of the uploaded bytes, so
+# analysing the same recording again returns immediately.
+RESULT_CACHE_SIZE = 128
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+
+def get_cached_results(cache_key):
+    """Returns a copy of the cached results for `cache_key`, or None."""
+    with _result_cache_lock:
+        results = _result_cache.get(cache_key)
+        if results is None:
+            return None
+        _result_cache.move_to_end(cache_key)
+        return dict(results)
+
+
+def cache_results(cache_key, results):
+    """Stores `results`, evicting the least recently used entry when full."""
+    with _result_cache_lock:
+        _result_cache[cache_key] = dict(results)
+        _result_cache.move_to_end(cache_key)
+        while len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+
+
+# --- Audio Buffer Pool ---
+# Reusable shared memory blocks for decoding uploads. Audio is decoded straight
+# into a borrowed block and the analysis workers attach to that same block, so
+# a request neither allocates a fresh multi-megabyte array nor copies it to
+# hand it to the pool. Requests that find the pool empty, or audio that won't
+# fit, fall back to a temporary block.
+AUDIO_BUFFER_SECONDS = 120
+AUDIO_BUFFER_COUNT = 4
+AUDIO_BUFFER_SAMPLES = 16000 * AUDIO_BUFFER_SECONDS
+_audio_buffer_blocks = []
+if not IS_CHILD_PROCESS:
+    _audio_buffer_blocks = [
+        shared_memory.SharedMemory(create=True, size=AUDIO_BUFFER_SAMPLES * np.dtype(np.float32).itemsize)
+        for _ in range(AUDIO_BUFFER_COUNT)
+    ]
+_audio_buffer_pool = queue.Queue()
+for _block in _audio_buffer_blocks:
+    _audio_buffer_pool.put(_block)
+
+
+@atexit.register
+def _free_audio_buffers():
+    """Releases the pooled blocks so they don't outlive the process."""
+    for block in _audio_buffer_blocks:
+        free_shared_block(block)
+
+
+def borrow_audio_buffer():
+    """Takes a block from the pool without blocking, or returns None if it's empty."""
+    try:
+        return _audio_buffer_pool.get_nowait()
+    except queue.Empty:
+        return None
+
+
+def release_audio_buffer(block):
+    """Returns a borrowed block to the pool."""
+    if block is not None:
+        _audio_buffer_pool.put(block)
+
+
+def run_full_analysis(audio_source, source_name=None):
     """
-    A single function to run all analyses on a given audio file path.
+    A single function to run all analyses on an audio file. `audio_source` may be
+    raw bytes, a file-like object (e.g. an upload stream) or a file path.
     """
-    print(f"Processing file: {audio_path}...")
+    if source_name is None:
+        source_name = audio_source if isinstance(audio_source, (str, os.PathLike)) else "uploaded audio"
+    print(f"Processing file: {source_name}...")
+    try:
+        if isinstance(audio_source, (str, os.PathLike)):
+            with open(audio_source, "rb") as f:
+                audio_bytes = f.read()
+        elif hasattr(audio_source, "read"):
+            audio_bytes = audio_source.read()
+        else:
+            audio_bytes = bytes(audio_source)
+    except Exception as e:
+        return {"error": f"Could not load audio file: {e}"}
+
+    # Re-uploads of the same file skip Whisper and librosa entirely
+    cache_key = hashlib.blake2b(audio_bytes, digest_size=16).hexdigest()
+    cached_results = get_cached_results(cache_key)
+    if cached_results is not None:
+        print("Returning cached analysis.")
+        return cached_results
+
+    block = borrow_audio_buffer()
     try:
-        # Use pydub to robustly load any audio format from the given path
-        audio_segment = AudioSegment.from_file(audio_path)
-        
-        # Convert to a standard format (mono, 16kHz) for consistent analysis
-        audio_segment = audio_segment.set_channels(1).set_frame_rate(16000)
+        analysis_results = analyze_audio_bytes(audio_bytes, block)
+    finally:
+        release_audio_buffer(block)
 
-        # Export to an in-memory WAV format bytes buffer
-        wav_buffer = io.BytesIO()
-        audio_segment.export(wav_buffer, format="wav")
-        wav_buffer.seek(0)
+    if "error" not in analysis_results:
+        cache_results(cache_key, analysis_results)
+    return analysis_results
 
-        # Load the WAV data from the in-memory buffer using librosa
-        y, sr = librosa.load(wav_buffer, sr=16000)
 
+def analyze_audio_bytes(audio_bytes, block=None):
+    """
+    Decodes `audio_bytes` (into the shared memory `block` when possible) and runs
+    every analysis. The block must not be reused until this returns.
+    """
+    buffer = None
+    if block is not None:
+        buffer = np.ndarray((AUDIO_BUFFER_SAMPLES,), dtype=np.float32, buffer=block.buf)
+    try:
+        # Decode in memory; libsndfile handles most formats, pydub the rest
+        y, sr = load_audio(audio_bytes, buffer)
     except Exception as e:
         return {"error": f"Could not load audio file: {e}"}
 
-    # Handle silent audio arrays
-    if np.max(np.abs(y)) < 0.001:
+    # Whisper and librosa both share this one buffer, so make sure it is already
+    # contiguous float32 and neither side has to make its own converted copy.
+    y = np.ascontiguousarray(y, dtype=np.float32)
+
+    # Handle silent audio arrays before any heavy work (Whisper, pitch, onsets).
+    # Checking the extremes avoids allocating an abs() copy of the whole signal.
+    if y.max(initial=0) < 1e-3 and y.min(initial=0) > -1e-3:
         return {
             "Clarity Score": 0.0,
             "Confidence Score": 0.0,
@@ -140,14 +417,23 @@ def run_full_analysis(audio_path):
             "Transcription": "Audio is silent or contains no speech."
         }
 
-    print("Transcribing audio data...")
-    transcription_result = whisper_model.transcribe(y) # Transcribe from memory
-    transcribed_text = transcription_result["text"]
-    print(f"Transcription: '{transcribed_text}'")
+    # Whisper and the librosa analyzers are independent (only confidence needs
+    # the transcript), so run them side by side: Whisper in this process where
+    # the model lives, the analyzers in the process pool.
+    acoustic_future, temp_block = submit_acoustic_analysis(y, sr, block)
+    try:
+        print("Transcribing audio data...")
+        transcribed_text = transcribe_audio(y) # Transcribe from memory
+        print(f"Transcription: '{transcribed_text}'")
+        clarity_score, engagement_score, volume_stability_score = acoustic_future.result()
+    finally:
+        # The worker may not still be reading the samples once the block is
+        # freed or handed to the next request
+        wait([acoustic_future])
+        if temp_block is not None:
+            free_shared_block(temp_block)
 
-    clarity_score = analyze_clarity(y, sr)
-    confidence_score = analyze_confidence(y, sr, transcribed_text)
-    engagement_score = analyze_energy_engagement(y, sr)
+    confidence_score = analyze_confidence(y, sr, transcribed_text, volume_stability_score)
     professionalism_score = placeholder_professionalism_score(clarity_score, confidence_score)
     mood_report = placeholder_mood_analysis() # Added the missing function call
 